@@ -16,14 +16,21 @@ Room Type options (value -> label):
   4 -> Family Suite (₹12100/night)
   5 -> Deluxe Sea View Room (₹20060/night)
   6 -> Presidential suite (₹11800/night)
+
+Runs on playwright.async_api: every step is a coroutine, so several bookings
+can share one event loop (see BookingPool).
 """
 
+import asyncio
 import logging
 import os
 import re
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict
 
+from playwright.async_api import TimeoutError as PWTimeout
+
 logger = logging.getLogger("BookingService")
 
 # Exact room type values from the HTML <option value="N">
@@ -45,6 +52,108 @@ ROOM_TYPE_VALUES = {
     "standard":             "3",  # closest to standard
 }
 
+# Cut background work in the headless browser
+CHROMIUM_ARGS = [
+    "--no-sandbox",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-renderer-backgrounding",
+    "--disable-features=TranslateUI,site-per-process",
+    "--metrics-recording-only",
+    "--no-first-run",
+]
+
+# Logged-in cookies/localStorage, so a restarted process can skip the login
+AUTH_STATE_PATH = "logs/.auth.json"
+
+# Longest (most specific) keys first, so "deluxe sea view room" wins over "deluxe"
+ORDERED_ROOM_KEYS = sorted(ROOM_TYPE_VALUES, key=len, reverse=True)
+
+# Booking ID patterns, most specific first
+ID_PATTERNS = [
+    re.compile(p, re.IGNORECASE)
+    for p in (r"#(\d+)", r"booking[_\-\s]?(?:id|no)[\s:#]*([A-Z0-9\-]+)", r"/bookings?/(\d+)")
+]
+
+# Requests the automation never needs. Stylesheets stay allowed: modal
+# visibility checks depend on the Bootstrap CSS being applied.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_DOMAINS = ("google-analytics.com", "googletagmanager.com", "segment.io", "hotjar.com")
+
+# Helpers installed once per page (via add_init_script) and called by name,
+# so the script source is not re-sent over CDP on every action.
+#   fillForm(p)    - sets every modal field with the native value setter (so
+#                    React sees the change); returns what the inputs hold
+#                    when p.readback is set
+#   clickConfirm() - JS click on the Confirm Booking button
+BOOKING_HELPERS_JS = """window.__bk = {
+    // Allocated once; an Event can be re-dispatched after its dispatch ends
+    events: ['input', 'change', 'blur'].map((type) => new Event(type, { bubbles: true })),
+    fire(el) {
+        for (const ev of this.events) el.dispatchEvent(ev);
+    },
+    fillForm(p) {
+        const setter = Object.getOwnPropertyDescriptor(
+            window.HTMLInputElement.prototype, 'value').set;
+        const fields = {
+            name:     document.querySelector('#bookingGuestName'),
+            email:    document.querySelector('#bookingEmail')
+                   || document.querySelector('form#bookingForm input[type="email"]'),
+            checkIn:  document.querySelector('#bookingCheckIn'),
+            checkOut: document.querySelector('#bookingCheckOut'),
+            adults:   document.querySelector('#bookingAdults'),
+            children: document.querySelector('#bookingChildren'),
+        };
+        for (const [key, el] of Object.entries(fields)) {
+            if (!el || p[key] === '' || p[key] === null || p[key] === undefined) continue;
+            setter.call(el, String(p[key]));
+            this.fire(el);
+        }
+        const room = document.querySelector('#bookingRoomType');
+        if (room && p.roomValue) {
+            room.value = p.roomValue;
+            this.fire(room);
+        }
+        if (!p.readback) return null;
+        const actual = {};
+        for (const [key, el] of Object.entries({ ...fields, roomValue: room })) {
+            actual[key] = el ? el.value : null;
+        }
+        return actual;
+    },
+    clickConfirm() {
+        const btn = document.querySelector('form#bookingForm button[type="submit"]')
+                 || document.querySelector('#bookingModal button[type="submit"]')
+                 || document.querySelector('button.btn-primary');
+        if (btn) { btn.click(); return 'clicked: ' + btn.textContent.trim(); }
+        return 'button not found';
+    },
+};"""
+
+
+@lru_cache(maxsize=128)
+def _get_room_value(room_type: str) -> str:
+    rt = room_type.lower().strip()
+    # Exact match first
+    if rt in ROOM_TYPE_VALUES:
+        return ROOM_TYPE_VALUES[rt]
+    # Partial match
+    for key in ORDERED_ROOM_KEYS:
+        if key in rt or rt in key:
+            return ROOM_TYPE_VALUES[key]
+    return ""
+
+
+@lru_cache(maxsize=128)
+def _best_option(room_type: str, options: tuple) -> str:
+    rt = room_type.lower()
+    for opt in options:
+        if rt in opt.lower() or opt.lower() in rt:
+            return opt.strip()
+    return ""
+
 
 class BookingService:
     def __init__(self, website_url, admin_username, admin_password, headless=True):
@@ -52,56 +161,212 @@ class BookingService:
         self.admin_username = admin_username
         self.admin_password = admin_password
         self.headless = headless
-
-    def create_booking(self, booking_details: Dict) -> Dict:
-        from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-
-        logger.info("Launching browser ...")
-        with sync_playwright() as p:
-            browser = p.chromium.launch(
+        self._playwright = None
+        self._browser = None
+        self._storage_state = None
+        self._login_lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+        self._bookings_page = None
+
+    # ── Browser lifecycle ─────────────────────────────────────────────────────
+    async def start(self):
+        """Launch one browser that is reused by every create_booking call."""
+        if self._browser:
+            return
+        # Concurrent callers wait here; only the first one launches
+        async with self._start_lock:
+            if self._browser:
+                return
+            from playwright.async_api import async_playwright
+
+            if self._storage_state is None and os.path.exists(AUTH_STATE_PATH):
+                logger.info("Reusing saved session from %s", AUTH_STATE_PATH)
+                self._storage_state = AUTH_STATE_PATH
+
+            logger.info("Launching browser ...")
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
                 headless=self.headless,
-                args=["--no-sandbox", "--disable-dev-shm-usage"],
+                args=self._launch_args(),
             )
-            ctx = browser.new_context(viewport={"width": 1280, "height": 900})
-            page = ctx.new_page()
-            page.set_default_timeout(30_000)
 
+    @staticmethod
+    def _launch_args() -> list:
+        args = list(CHROMIUM_ARGS)
+        # Shared memory is faster, but a small /dev/shm (e.g. Docker's 64 MB) crashes tabs
+        if hasattr(os, "statvfs") and os.path.exists("/dev/shm"):
+            st = os.statvfs("/dev/shm")
+            if st.f_frsize * st.f_blocks < 256 * 1024 * 1024:
+                args.append("--disable-dev-shm-usage")
+        return args
+
+    async def stop(self):
+        if self._bookings_page:
+            await self._bookings_page.context.close()
+            self._bookings_page = None
+        if self._browser:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+        self._storage_state = None
+
+    def is_connected(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def __aenter__(self):
+        # Browser is launched lazily on the first create_booking call
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def create_booking(self, booking_details: Dict) -> Dict:
+        """Book on a page kept parked on Bookings between calls (one at a time)."""
+        await self.start()
+        if self._bookings_page is None:
+            self._bookings_page = await self._new_page()
+        return await self._run(self._bookings_page, booking_details)
+
+    async def _new_context(self):
+        ctx = await self._browser.new_context(
+            viewport={"width": 1024, "height": 768},
+            storage_state=self._storage_state,
+        )
+        await ctx.add_init_script(BOOKING_HELPERS_JS)
+        await ctx.route("**/*", self._route_filter)
+        return ctx
+
+    async def _new_page(self):
+        """New page in its own context; it stays open to be parked on Bookings."""
+        ctx = await self._new_context()
+        page = await ctx.new_page()
+        page.set_default_timeout(30_000)
+        return page
+
+    async def _run(self, page, booking_details: Dict, retry_login: bool = True) -> Dict:
+        """
+        Book on page, reusing it as-is if it is still parked on Bookings.
+        A parked page can outlive its session; if the submit bounces to
+        login, log in again and retry the booking once.
+        """
+        try:
+            if not await self._is_parked(page):
+                if self._storage_state is None or not await self._resume_session(page):
+                    async with self._login_lock:
+                        await self._login(page)
+                        await self._save_session(page.context)
+                await self._go_to_bookings(page)
+            await self._open_create_modal(page)
+            await self._fill_modal(page, booking_details)
+            result = await self._confirm(page)
+            if result.pop("session_expired", False) and retry_login:
+                return await self._retry_after_login(page, booking_details)
+            return result
+        except PWTimeout as e:
+            if retry_login and await self._on_login_page(page):
+                # e.g. Create Booking on a stale parked page redirected to login
+                return await self._retry_after_login(page, booking_details)
+            logger.error("Timeout: %s", e)
+            await self._screenshot(page, "timeout")
+            return {"success": False, "message": "Website timed out.", "booking_id": None}
+        except Exception as e:
+            logger.error("Error: %s", e, exc_info=True)
+            await self._screenshot(page, "error")
+            return {"success": False, "message": f"Automation error: {e}", "booking_id": None}
+
+    async def _retry_after_login(self, page, booking_details: Dict) -> Dict:
+        logger.warning("Session expired while booking; logging in again and retrying once.")
+        self._forget_session()
+        return await self._run(page, booking_details, retry_login=False)
+
+    async def warm_up(self):
+        """Log in once up front so every new context starts authenticated."""
+        await self.start()
+        async with self._login_lock:
+            if self._storage_state is not None:
+                return
+            ctx = await self._new_context()
             try:
-                self._login(page)
-                self._go_to_bookings(page)
-                self._open_create_modal(page)
-                self._fill_modal(page, booking_details)
-                result = self._confirm(page)
-                return result
-            except PWTimeout as e:
-                logger.error(f"Timeout: {e}")
-                self._screenshot(page, "timeout")
-                return {"success": False, "message": "Website timed out.", "booking_id": None}
-            except Exception as e:
-                logger.error(f"Error: {e}", exc_info=True)
-                self._screenshot(page, "error")
-                return {"success": False, "message": f"Automation error: {e}", "booking_id": None}
+                page = await ctx.new_page()
+                await self._login(page)
+                await self._save_session(ctx)
             finally:
-                ctx.close()
-                browser.close()
+                await ctx.close()
 
     # ── Login ─────────────────────────────────────────────────────────────────
-    def _login(self, page):
+    async def _login(self, page):
         logger.info("Logging in ...")
-        page.goto(self.website_url, wait_until="networkidle")
-        page.fill('input[placeholder="Enter username"]', self.admin_username)
-        page.fill('input[placeholder="Enter password"]', self.admin_password)
-        page.click('button:has-text("Login")')
-        page.wait_for_load_state("networkidle")
-        page.wait_for_timeout(2000)
-        if "login" in page.url.lower():
+        await page.goto(self.website_url, wait_until="domcontentloaded")
+        await page.wait_for_selector('input[placeholder="Enter username"]')
+        await page.fill('input[placeholder="Enter username"]', self.admin_username)
+        await page.fill('input[placeholder="Enter password"]', self.admin_password)
+        await page.click('button:has-text("Login")')
+        try:
+            await page.wait_for_url(lambda u: "login" not in u.lower(), timeout=15_000)
+            # The URL may never have contained "login"; require the logged-in UI too
+            await page.wait_for_selector('a:has-text("Bookings"), nav', timeout=15_000)
+        except PWTimeout:
             raise RuntimeError("Login failed.")
-        logger.info(f"Logged in -> {page.url}")
+        logger.info("Logged in -> %s", page.url)
+
+    async def _resume_session(self, page) -> bool:
+        """Open the site with the stored session; False if it bounced to login."""
+        await page.goto(self.website_url, wait_until="domcontentloaded")
+        await page.wait_for_selector('a:has-text("Bookings"), nav, input[placeholder="Enter username"]')
+        if await page.locator('input[placeholder="Enter username"]').is_visible():
+            logger.info("Stored session expired.")
+            self._forget_session()
+            return False
+        return True
+
+    def _forget_session(self):
+        """Drop the stored session so the next _run logs in again."""
+        self._storage_state = None
+        try:
+            os.remove(AUTH_STATE_PATH)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    async def _on_login_page(page) -> bool:
+        if "login" in page.url.lower():
+            return True
+        try:
+            return await page.locator('input[placeholder="Enter username"]').is_visible()
+        except Exception:
+            return False
+
+    async def _save_session(self, ctx):
+        """Keep the logged-in state in memory and on disk for the next process."""
+        os.makedirs("logs", exist_ok=True)
+        self._storage_state = await ctx.storage_state(path=AUTH_STATE_PATH)
+
+    async def _is_parked(self, page) -> bool:
+        """
+        True if page is still on Bookings from a previous booking: Create
+        Booking is showing, the modal is closed and no old toast is left
+        that could be mistaken for the next result. Anything else (blank
+        page, bounced to login, leftover modal) goes through the full path.
+        """
+        if page.url == "about:blank":
+            return False
+        try:
+            return (
+                await page.locator('button:has-text("Create Booking")').first.is_visible()
+                and not await page.locator('#bookingModal').is_visible()
+                and not await page.locator(
+                    "text=/booking confirmed|successfully|booking created/i"
+                ).first.is_visible()
+            )
+        except Exception:
+            return False
 
     # ── Go to Bookings ────────────────────────────────────────────────────────
-    def _go_to_bookings(self, page):
+    async def _go_to_bookings(self, page):
         logger.info("Navigating to Bookings ...")
-        page.wait_for_timeout(1500)
+        await page.wait_for_selector('a:has-text("Bookings"), nav')
         clicked = False
         for attempt in [
             lambda: page.get_by_role("link", name="Bookings").click(),
@@ -109,35 +374,34 @@ class BookingService:
             lambda: page.get_by_text("Bookings", exact=True).first.click(),
         ]:
             try:
-                attempt()
+                await attempt()
                 clicked = True
                 break
             except Exception:
                 continue
         if not clicked:
-            page.goto(f"{self.website_url}/bookings", wait_until="networkidle")
-        page.wait_for_load_state("networkidle")
-        page.wait_for_timeout(1500)
-        logger.info(f"On bookings page -> {page.url}")
+            await page.goto(f"{self.website_url}/bookings", wait_until="domcontentloaded")
+        await page.locator('button:has-text("Create Booking")').first.wait_for(state="visible")
+        logger.info("On bookings page -> %s", page.url)
 
     # ── Open modal ────────────────────────────────────────────────────────────
-    def _open_create_modal(self, page):
+    async def _open_create_modal(self, page):
         logger.info("Opening modal ...")
         for sel in ['button:has-text("Create Booking")', 'button:has-text("+ Create Booking")']:
             try:
                 btn = page.locator(sel).first
-                if btn.is_visible(timeout=3000):
-                    btn.click()
+                if await btn.is_visible(timeout=3000):
+                    await btn.click()
                     break
             except Exception:
                 continue
-        page.wait_for_selector('#bookingModal', state="visible", timeout=10_000)
-        page.wait_for_timeout(800)
+        await page.wait_for_selector('#bookingModal', state="visible", timeout=10_000)
+        await page.wait_for_selector('#bookingGuestName', state="visible")
         logger.info("Modal opened.")
 
     # ── Fill modal — ALL IDs CONFIRMED ────────────────────────────────────────
-    def _fill_modal(self, page, details: Dict):
-        logger.info(f"Filling form: {details}")
+    async def _fill_modal(self, page, details: Dict):
+        logger.info("Filling form: %s", details)
 
         guest_name   = details.get("guest_name", "")
         guest_email  = details.get("guest_email", "")
@@ -150,173 +414,77 @@ class BookingService:
         if not guest_name and guest_email:
             guest_name = guest_email.split("@")[0]
 
-        # 1. Guest Name — confirmed: #bookingGuestName
-        page.fill("#bookingGuestName", guest_name)
-        logger.info(f"  name -> '{guest_name}'")
-
-        # 2. Email — try #bookingEmail, fallback to type=email inside form
-        try:
-            page.fill("#bookingEmail", guest_email)
-            logger.info(f"  email -> '{guest_email}' via #bookingEmail")
-        except Exception:
+        room_value = _get_room_value(room_type) if room_type else ""
+
+        # All fields are written in a single round-trip
+        actual = await page.evaluate("(p) => window.__bk.fillForm(p)", {
+            "name": guest_name,
+            "email": guest_email,
+            "checkIn": check_in,
+            "checkOut": check_out,
+            "roomValue": room_value,
+            "adults": num_adults,
+            "children": num_children,
+            "readback": logger.isEnabledFor(logging.DEBUG),
+        })
+        for field, value in (actual or {}).items():
+            logger.debug("  %s -> '%s'", field, value)
+
+        # Room type not in our value map: select by partial label text
+        if room_type and not room_value:
             try:
-                page.fill('form#bookingForm input[type="email"]', guest_email)
-                logger.info(f"  email -> '{guest_email}' via type=email")
+                opts = await page.locator("#bookingRoomType option").all_text_contents()
+                best = _best_option(room_type, tuple(opts))
+                if best:
+                    await page.select_option("#bookingRoomType", label=best)
+                    logger.info("  room type -> label='%s'", best)
             except Exception as e:
-                logger.warning(f"  email fill failed: {e}")
-
-        # 3. Check-in — confirmed: #bookingCheckIn (type="date")
-        if check_in:
-            self._set_date(page, "#bookingCheckIn", check_in)
-            logger.info(f"  check-in -> '{check_in}'")
-
-        # 4. Check-out — confirmed: #bookingCheckOut (type="date")
-        if check_out:
-            self._set_date(page, "#bookingCheckOut", check_out)
-            logger.info(f"  check-out -> '{check_out}'")
-
-        page.wait_for_timeout(300)
-
-        # 5. Room Type — confirmed: #bookingRoomType (select, value-based)
-        if room_type:
-            value = self._get_room_value(room_type)
-            try:
-                if value:
-                    page.select_option("#bookingRoomType", value=value)
-                    logger.info(f"  room type -> value='{value}' for '{room_type}'")
-                else:
-                    # fallback: select by partial label text
-                    opts = page.locator("#bookingRoomType option").all_text_contents()
-                    best = self._best_option(room_type, opts)
-                    if best:
-                        page.select_option("#bookingRoomType", label=best)
-                        logger.info(f"  room type -> label='{best}'")
-            except Exception as e:
-                logger.warning(f"  room type error: {e}")
-
-        page.wait_for_timeout(300)
+                logger.warning("  room type error: %s", e)
 
-        # 6. Adults — confirmed: #bookingAdults (number, min=1)
-        self._set_number(page, "#bookingAdults", num_adults)
-        logger.info(f"  adults -> {num_adults}")
-
-        # 7. Children — confirmed: #bookingChildren (number, min=0)
-        self._set_number(page, "#bookingChildren", num_children)
-        logger.info(f"  children -> {num_children}")
-
-        page.wait_for_timeout(400)
-        self._screenshot(page, "form_filled")
+        await self._screenshot(page, "form_filled")
         logger.info("Form filled - check logs/screenshot_form_filled_*.png")
 
-    # ── Set <input type="date"> via JS ────────────────────────────────────────
-    def _set_date(self, page, selector: str, iso_date: str):
-        """
-        Sets date input value using JS native setter.
-        This is the only reliable method for <input type="date">.
-        Value must be YYYY-MM-DD format.
-        """
-        page.evaluate("""(args) => {
-            const el = document.querySelector(args.sel);
-            if (!el) { console.error('Not found:', args.sel); return; }
-            const setter = Object.getOwnPropertyDescriptor(
-                window.HTMLInputElement.prototype, 'value').set;
-            setter.call(el, args.val);
-            el.dispatchEvent(new Event('input',  { bubbles: true }));
-            el.dispatchEvent(new Event('change', { bubbles: true }));
-            el.dispatchEvent(new Event('blur',   { bubbles: true }));
-        }""", {"sel": selector, "val": iso_date})
-        page.wait_for_timeout(200)
-
-        actual = page.evaluate(f"document.querySelector('{selector}')?.value")
-        logger.info(f"  {selector} set to '{actual}'")
-
-    # ── Set <input type="number"> via JS ──────────────────────────────────────
-    def _set_number(self, page, selector: str, value: int):
-        page.evaluate("""(args) => {
-            const el = document.querySelector(args.sel);
-            if (!el) return;
-            el.scrollIntoView({ block: 'center' });
-            const setter = Object.getOwnPropertyDescriptor(
-                window.HTMLInputElement.prototype, 'value').set;
-            setter.call(el, String(args.val));
-            el.dispatchEvent(new Event('input',  { bubbles: true }));
-            el.dispatchEvent(new Event('change', { bubbles: true }));
-            el.dispatchEvent(new Event('blur',   { bubbles: true }));
-        }""", {"sel": selector, "val": value})
-        page.wait_for_timeout(150)
-        actual = page.evaluate(f"document.querySelector('{selector}')?.value")
-        logger.info(f"  {selector} set to '{actual}'")
-
     # ── Confirm ───────────────────────────────────────────────────────────────
-    def _confirm(self, page) -> Dict:
+    async def _confirm(self, page) -> Dict:
         logger.info("Clicking Confirm Booking ...")
 
-        # Scroll inside the modal to reveal the Confirm button at the bottom
-        page.evaluate("""() => {
-            // Try scrolling the modal content div
-            const selectors = [
-                '#bookingModal .modal-content',
-                '#bookingModal .modal-body',
-                '#bookingModal',
-                '.modal-content'
-            ];
-            for (const sel of selectors) {
-                const el = document.querySelector(sel);
-                if (el) { el.scrollTop = el.scrollHeight; }
-            }
-            // Also scroll the confirm button into view directly
-            const btn = document.querySelector('form#bookingForm button[type="submit"]');
-            if (btn) btn.scrollIntoView({ behavior: 'instant', block: 'center' });
-        }""")
-        page.wait_for_timeout(600)
-
         # Confirmed HTML: <button type="submit" class="btn btn-primary"> Confirm Booking </button>
-        # Try click, then JS click as fallback
-        clicked = False
-
-        # First try: Playwright click
-        for sel in [
-            'form#bookingForm button[type="submit"]',
-            '#bookingModal button[type="submit"]',
-            'button.btn-primary',
-            'button:has-text("Confirm Booking")',
-        ]:
-            try:
-                btn = page.locator(sel).first
-                btn.scroll_into_view_if_needed()
-                page.wait_for_timeout(300)
-                if btn.is_visible(timeout=2000):
-                    btn.click()
-                    clicked = True
-                    logger.info(f"Clicked Confirm via: {sel}")
-                    break
-            except Exception:
-                continue
-
-        # Second try: JavaScript click (bypasses visibility/scroll issues)
-        if not clicked:
+        # click() scrolls it into view and waits until it is actionable
+        try:
+            await page.locator('form#bookingForm button[type="submit"]').first.click(timeout=5_000)
+            logger.info("Clicked Confirm Booking.")
+        except PWTimeout:
+            # JavaScript click (bypasses visibility/scroll issues)
             logger.warning("Playwright click failed, trying JS click ...")
-            result = page.evaluate("""() => {
-                const btn = document.querySelector('form#bookingForm button[type="submit"]')
-                          || document.querySelector('#bookingModal button[type="submit"]')
-                          || document.querySelector('button.btn-primary');
-                if (btn) { btn.click(); return 'clicked: ' + btn.textContent.trim(); }
-                return 'button not found';
-            }""")
-            logger.info(f"JS click result: {result}")
-            clicked = True
-
-        page.wait_for_load_state("networkidle", timeout=20_000)
-        page.wait_for_timeout(2000)
-        self._screenshot(page, "after_confirm")
+            result = await page.evaluate("() => window.__bk.clickConfirm()")
+            logger.info("JS click result: %s", result)
+
+        # Resolve as soon as the modal closes or a success toast shows up
+        try:
+            await page.wait_for_function("""() => {
+                const m = document.querySelector('#bookingModal');
+                if (!m || !(m.offsetWidth || m.offsetHeight || m.getClientRects().length)) return true;
+                return /booking confirmed|successfully|booking created/i.test(document.body.innerText);
+            }""", timeout=20_000)
+        except PWTimeout:
+            logger.warning("No modal close / success toast within 20s.")
+        await self._screenshot(page, "after_confirm")
+
+        # Bounced to login: the modal is gone, but nothing was booked
+        if await self._on_login_page(page):
+            logger.warning("Redirected to login after Confirm Booking.")
+            return {
+                "success": False, "message": "Session expired before the booking was saved.",
+                "booking_id": None, "session_expired": True,
+            }
 
         for text in ["booking confirmed", "successfully", "booking created", "success"]:
             try:
                 elem = page.locator(f"text=/{text}/i").first
-                if elem.is_visible(timeout=3_000):
-                    msg = elem.inner_text()
+                if await elem.is_visible(timeout=3_000):
+                    msg = await elem.inner_text()
                     bid = self._extract_id(msg + page.url)
-                    logger.info(f"Booking successful - ID: {bid}")
+                    logger.info("Booking successful - ID: %s", bid)
                     return {"success": True, "message": msg, "booking_id": bid}
             except Exception:
                 pass
@@ -324,14 +492,14 @@ class BookingService:
         for sel in ['.alert-danger', '[class*="error"]', 'text=/not available/i']:
             try:
                 elem = page.locator(sel).first
-                if elem.is_visible(timeout=2_000):
-                    err = elem.inner_text()
+                if await elem.is_visible(timeout=2_000):
+                    err = await elem.inner_text()
                     return {"success": False, "message": err.strip(), "booking_id": None}
             except Exception:
                 pass
 
         try:
-            modal_gone = not page.locator('#bookingModal').is_visible(timeout=2000)
+            modal_gone = not await page.locator('#bookingModal').is_visible(timeout=2000)
         except Exception:
             modal_gone = True
 
@@ -344,40 +512,93 @@ class BookingService:
 
     # ── Helpers ───────────────────────────────────────────────────────────────
     @staticmethod
-    def _get_room_value(room_type: str) -> str:
-        rt = room_type.lower().strip()
-        # Exact match first
-        if rt in ROOM_TYPE_VALUES:
-            return ROOM_TYPE_VALUES[rt]
-        # Partial match
-        for key, val in ROOM_TYPE_VALUES.items():
-            if key in rt or rt in key:
-                return val
-        return ""
-
-    @staticmethod
-    def _best_option(room_type: str, options: list) -> str:
-        rt = room_type.lower()
-        for opt in options:
-            if rt in opt.lower() or opt.lower() in rt:
-                return opt.strip()
-        return ""
+    async def _route_filter(route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+            d in request.url for d in BLOCKED_DOMAINS
+        ):
+            await route.abort()
+        else:
+            await route.continue_()
 
     @staticmethod
     def _extract_id(text: str) -> str:
-        for pat in [r"#(\d+)", r"booking[_\-\s]?(?:id|no)[\s:#]*([A-Z0-9\-]+)", r"/bookings?/(\d+)"]:
-            m = re.search(pat, text, re.IGNORECASE)
+        for pat in ID_PATTERNS:
+            m = pat.search(text)
             if m:
                 return m.group(1)
         return "N/A"
 
     @staticmethod
-    def _screenshot(page, label: str):
+    async def _screenshot(page, label: str):
         try:
             os.makedirs("logs", exist_ok=True)
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             path = f"logs/screenshot_{label}_{ts}.png"
-            page.screenshot(path=path)
-            logger.info(f"Screenshot saved: {path}")
+            await page.screenshot(path=path)
+            logger.info("Screenshot saved: %s", path)
         except Exception as e:
-            logger.debug(f"Screenshot failed: {e}")
\ No newline at end of file
+            logger.debug("Screenshot failed: %s", e)
+
+
+class BookingPool:
+    """
+    Runs bookings concurrently on one shared browser.
+    Up to max_concurrent pages (each in its own BrowserContext seeded with
+    the logged-in storage_state) are kept parked on Bookings and handed
+    out one booking at a time. Pages stay parked between batches until
+    stop() is called.
+    """
+
+    def __init__(self, service: BookingService, max_concurrent: int = 4):
+        self.service = service
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._idle = []
+
+    async def start(self):
+        await self.service.warm_up()
+
+    async def stop(self):
+        while self._idle:
+            await self._idle.pop().context.close()
+        await self.service.stop()
+
+    async def __aenter__(self):
+        # Browser is launched and logged in lazily by the first acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def acquire(self):
+        await self._semaphore.acquire()
+        try:
+            if self.service._browser is not None and not self.service.is_connected():
+                async with self.service._start_lock:
+                    # Re-check: another acquire() may already have torn it down
+                    if self.service._browser is not None and not self.service.is_connected():
+                        # Browser went away between polls; relaunch on a clean slate
+                        logger.warning("Browser disconnected, relaunching ...")
+                        self._idle.clear()
+                        await self.service.stop()
+            while self._idle:
+                page = self._idle.pop()
+                # Pages of a browser that has since died come back closed
+                if not page.is_closed():
+                    return page
+            await self.start()
+            return await self.service._new_page()
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    def release(self, page):
+        self._idle.append(page)
+        self._semaphore.release()
+
+    async def create_booking(self, booking_details: Dict) -> Dict:
+        page = await self.acquire()
+        try:
+            return await self.service._run(page, booking_details)
+        finally:
+            self.release(page)
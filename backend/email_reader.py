@@ -4,18 +4,30 @@ Connects to Gmail via IMAP, finds unread Room Booking emails,
 and extracts the plain-text body for further processing.
 """
 
+import base64
 import email
+import email.message
+import email.policy
 import imaplib
 import logging
+import quopri
 import re
+import time
+from contextlib import contextmanager
 from email.header import decode_header
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
+
+from imapclient import IMAPClient
+from imapclient.response_parser import parse_fetch_response
 
 logger = logging.getLogger("EmailReader")
 
 IMAP_SERVER = "imap.gmail.com"
 IMAP_PORT = 993
+IDLE_RENEW_SECONDS = 25 * 60  # servers end IDLE after ~29 minutes; doubles as a safety poll
 BOOKING_SUBJECT_KEYWORD = "Room Booking"
+SENDER_RE = re.compile(r'"?([^"<]*)"?\s*<([^>]+)>')
+FETCH_START_RE = re.compile(rb"(\d+) \(")
 
 
 class EmailReader:
@@ -24,6 +36,10 @@ class EmailReader:
             raise ValueError("Gmail address and App Password are required.")
         self.gmail_address = gmail_address
         self.app_password = app_password
+        self._mail = None
+        self._seen = []
+        self._idler = None
+        self._idle_since = None
 
     def _connect(self) -> imaplib.IMAP4_SSL:
         """Establish an authenticated IMAP connection."""
@@ -34,51 +50,182 @@ class EmailReader:
             logger.debug("✅ Connected to Gmail IMAP.")
             return mail
         except imaplib.IMAP4.error as e:
-            logger.error(f"❌ IMAP login failed: {e}")
+            logger.error("❌ IMAP login failed: %s", e)
             raise ConnectionError(
                 f"Gmail authentication failed. Make sure you're using a 16-character App Password. Error: {e}"
             )
 
-    def fetch_booking_emails(self) -> List[Dict]:
+    @contextmanager
+    def fetch_booking_emails(self) -> Iterator[List[Dict]]:
         """
-        Search for unread emails with 'Room Booking' in the subject.
-        Returns a list of parsed email dictionaries.
+        Search for unread emails with 'Room Booking' in the subject and
+        yield them as a list of parsed email dictionaries.
+        The IMAP connection stays open for the with-block: mark_as_read()
+        calls made inside it are applied in one STORE before logout.
         """
         mail = self._connect()
-        results = []
+        self._mail = mail
+        self._seen = []
+
+        try:
+            yield self._fetch_unseen(mail)
+        finally:
+            seen = self._seen
+            self._mail = None
+            self._seen = []
+            stored = not seen or self._store_seen(mail, seen)
+            try:
+                mail.logout()
+            except Exception as e:
+                logger.warning("IMAP logout failed: %s", e)
+            if not stored:
+                # The batch connection likely dropped during booking; these emails
+                # were already answered, so they must not be picked up again
+                logger.info("Retrying mark-as-read on a new connection ...")
+                self._mark_on_new_connection(seen)
 
+    # ── New-mail notifications (IMAP IDLE) ───────────────────────────────────
+    def wait_for_new_mail(self, timeout: float = 5) -> bool:
+        """
+        Block for up to `timeout` seconds on a long-lived IDLE connection and
+        return True when the inbox should be checked: the server reported new
+        mail (EXISTS), or IDLE was just (re)started.
+        IDLE is always active again before this returns, so mail arriving
+        while the caller checks the inbox is still reported on the next call.
+        Notifications that arrive between calls are buffered by the server
+        connection, so short timeouts lose nothing.
+        """
         try:
-            # Search for unread emails matching the subject keyword
-            search_criteria = f'(UNSEEN SUBJECT "{BOOKING_SUBJECT_KEYWORD}")'
-            status, message_ids = mail.search(None, search_criteria)
+            if self._idler is None:
+                self._idler = self._connect_idle()
+            if self._idle_since is not None and time.monotonic() - self._idle_since > IDLE_RENEW_SECONDS:
+                self._idler.idle_done()
+                self._idle_since = None
+            if self._idle_since is None:
+                # Fresh connection or renewal: anything may have arrived while
+                # not idling (or a previous fetch failed), so ask for a catch-up
+                self._idler.idle()
+                self._idle_since = time.monotonic()
+                return True
+            responses = self._idler.idle_check(timeout=timeout)
+        except Exception:
+            # Drop the connection; the next call reconnects
+            self._close_idle()
+            raise
+        return self._has_new_mail(responses)
+
+    @staticmethod
+    def _has_new_mail(responses: list) -> bool:
+        return any(len(r) > 1 and r[1] == b"EXISTS" for r in responses)
+
+    def _connect_idle(self) -> IMAPClient:
+        client = IMAPClient(IMAP_SERVER, port=IMAP_PORT, ssl=True)
+        client.login(self.gmail_address, self.app_password)
+        client.select_folder("INBOX")
+        logger.debug("✅ IDLE connection to Gmail IMAP open.")
+        return client
+
+    def close(self):
+        """Log out the long-lived IDLE connection, if one is open."""
+        self._close_idle()
+
+    def _close_idle(self):
+        idler, idle_since = self._idler, self._idle_since
+        self._idler, self._idle_since = None, None
+        if idler is not None:
+            try:
+                if idle_since is not None:
+                    idler.idle_done()
+                idler.logout()
+            except Exception:
+                pass
+
+    def _fetch_unseen(self, mail: imaplib.IMAP4_SSL) -> List[Dict]:
+        # Search for unread emails matching the subject keyword
+        search_criteria = f'(UNSEEN SUBJECT "{BOOKING_SUBJECT_KEYWORD}")'
+        status, message_ids = mail.search(None, search_criteria)
 
-            if status != "OK" or not message_ids[0]:
-                return results
+        if status != "OK" or not message_ids[0]:
+            return []
 
-            uid_list = message_ids[0].split()
-            logger.info(f"📬 Found {len(uid_list)} unread booking email(s).")
+        uid_list = message_ids[0].split()
+        logger.info("📬 Found %s unread booking email(s).", len(uid_list))
 
-            for uid in uid_list:
+        # One BODYSTRUCTURE fetch for the whole set, then one body fetch per
+        # distinct text/plain section (usually just one)
+        parts = {}
+        status, raw_data = mail.fetch(b",".join(uid_list).decode(), "(BODYSTRUCTURE)")
+        if status == "OK":
+            try:
+                structures = parse_fetch_response(raw_data, uid_is_key=False)
+            except Exception as e:
+                logger.debug("Could not parse BODYSTRUCTURE response: %s", e)
+                structures = {}
+            for seq, data in structures.items():
+                uid = str(seq).encode()
                 try:
-                    email_data = self._fetch_email(mail, uid)
-                    if email_data:
-                        results.append(email_data)
+                    parts[uid] = self._find_plain_part(data[b"BODYSTRUCTURE"])
                 except Exception as e:
-                    logger.error(f"Error parsing email UID {uid}: {e}")
+                    logger.debug("Could not read BODYSTRUCTURE of UID %s: %s", uid, e)
 
-        finally:
-            mail.logout()
+        by_section = {}
+        for uid in uid_list:
+            by_section.setdefault(parts.get(uid) and parts[uid][0], []).append(uid)
 
-        return results
+        fetched = {}
+        for section, uids in by_section.items():
+            uid_set = b",".join(uids).decode()
+            if section:
+                query = f"(BODY.PEEK[{section}] BODY.PEEK[HEADER.FIELDS (SUBJECT FROM)])"
+            else:
+                query = "(BODY.PEEK[])"
+            status, raw_data = mail.fetch(uid_set, query)
+            if status != "OK":
+                logger.error("Could not fetch email UIDs %s", uid_set)
+                continue
+            fetched.update(self._split_fetch_response(raw_data))
 
-    def _fetch_email(self, mail: imaplib.IMAP4_SSL, uid: bytes) -> Optional[Dict]:
-        """Fetch and parse a single email by UID."""
-        status, raw_data = mail.fetch(uid, "(RFC822)")
-        if status != "OK":
-            return None
+        results = []
+        skipped = []
+        for uid in uid_list:
+            if uid not in fetched:
+                continue
+            try:
+                email_data = self._parse_email(uid, fetched[uid], parts.get(uid))
+                if email_data:
+                    results.append(email_data)
+                else:
+                    skipped.append(uid)
+            except Exception as e:
+                logger.error("Error parsing email UID %s: %s", uid, e)
+
+        if skipped:
+            # PEEK leaves them unread; flag them so they are not picked up every poll
+            self._store_seen(mail, skipped)
+
+        return results
 
-        raw_email = raw_data[0][1]
-        msg = email.message_from_bytes(raw_email)
+    def _parse_email(self, uid: bytes, items: list, part: Optional[tuple]) -> Optional[Dict]:
+        """
+        Build the email dict from one message's fetched items.
+        part is (section, encoding, charset) of its text/plain part, or None
+        if the full message was fetched instead.
+        """
+        if part:
+            _, encoding, charset = part
+            headers = payload = b""
+            for item in items:
+                if isinstance(item, tuple):
+                    if b"HEADER.FIELDS" in item[0].upper():
+                        headers = item[1]
+                    else:
+                        payload = item[1]
+            msg = email.message_from_bytes(headers)
+            body = self._decode_part(payload, encoding, charset)
+        else:
+            raw_email = next(item[1] for item in items if isinstance(item, tuple))
+            msg = email.message_from_bytes(raw_email, policy=email.policy.default)
+            body = self._extract_body(msg)
 
         # Decode subject
         subject = self._decode_header_value(msg.get("Subject", ""))
@@ -87,14 +234,11 @@ class EmailReader:
         from_raw = msg.get("From", "")
         sender_name, sender_email = self._parse_sender(from_raw)
 
-        # Extract plain text body
-        body = self._extract_body(msg)
-
         if not body:
-            logger.warning(f"⚠️ Email UID {uid} has no readable text body. Skipping.")
+            logger.warning("⚠️ Email UID %s has no readable text body. Skipping.", uid)
             return None
 
-        logger.debug(f"Parsed email: from={sender_email}, subject={subject}")
+        logger.debug("Parsed email: from=%s, subject=%s", sender_email, subject)
 
         return {
             "uid": uid,
@@ -104,41 +248,111 @@ class EmailReader:
             "body": body,
         }
 
-    def _extract_body(self, msg: email.message.Message) -> str:
-        """Walk email parts and extract plain text content."""
-        body_parts = []
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                disposition = str(part.get("Content-Disposition", ""))
-
-                if content_type == "text/plain" and "attachment" not in disposition:
-                    try:
-                        charset = part.get_content_charset() or "utf-8"
-                        text = part.get_payload(decode=True).decode(charset, errors="replace")
-                        body_parts.append(text)
-                    except Exception as e:
-                        logger.debug(f"Could not decode email part: {e}")
-        else:
-            try:
-                charset = msg.get_content_charset() or "utf-8"
-                text = msg.get_payload(decode=True).decode(charset, errors="replace")
-                body_parts.append(text)
-            except Exception as e:
-                logger.debug(f"Could not decode email body: {e}")
+    @staticmethod
+    def _split_fetch_response(raw_data: list) -> Dict[bytes, list]:
+        """Group the items of a multi-message FETCH response by message number."""
+        grouped = {}
+        current = None
+        for item in raw_data:
+            head = item[0] if isinstance(item, tuple) else item
+            if not head:
+                continue
+            m = FETCH_START_RE.match(head)
+            if m:
+                current = grouped.setdefault(m.group(1), [])
+            if current is not None:
+                current.append(item)
+        return grouped
+
+    @staticmethod
+    def _find_plain_part(structure, prefix: str = "") -> Optional[tuple]:
+        """
+        Return (section, encoding, charset) of the first text/plain part of
+        an imapclient BodyData structure (multipart children come as a list).
+        """
+        if structure.is_multipart:
+            for i, child in enumerate(structure[0], 1):
+                found = EmailReader._find_plain_part(child, f"{prefix}{i}.")
+                if found:
+                    return found
+            return None
+
+        def text(value) -> str:
+            return value.decode("utf-8", errors="replace") if isinstance(value, bytes) else str(value or "")
+
+        if text(structure[0]).lower() != "text" or text(structure[1]).lower() != "plain":
+            return None
+        for ext in structure[7:]:
+            if isinstance(ext, tuple) and ext and text(ext[0]).lower() == "attachment":
+                return None
+        params = structure[2] or ()
+        charset = "utf-8"
+        for key, value in zip(params[::2], params[1::2]):
+            if text(key).lower() == "charset" and value:
+                charset = text(value)
+        encoding = (text(structure[5]) or "7bit").lower()
+        return (prefix.rstrip(".") or "1"), encoding, charset
+
+    @staticmethod
+    def _decode_part(payload: bytes, encoding: str, charset: str) -> str:
+        """Undo the transfer encoding of a single fetched MIME part."""
+        try:
+            if encoding == "base64":
+                payload = base64.b64decode(payload)
+            elif encoding == "quoted-printable":
+                payload = quopri.decodestring(payload)
+            return payload.decode(charset, errors="replace").strip()
+        except Exception as e:
+            logger.debug("Could not decode email part: %s", e)
+            return ""
 
-        return "\n".join(body_parts).strip()
+    def _extract_body(self, msg: email.message.EmailMessage) -> str:
+        """Return the first plain text part (msg must use policy.default)."""
+        part = msg.get_body(preferencelist=("plain",))
+        if part is None and not msg.is_multipart():
+            part = msg
+        if part is None:
+            return ""
+        try:
+            return part.get_content().strip()
+        except Exception as e:
+            logger.debug("Could not decode email body: %s", e)
+            return ""
 
     def mark_as_read(self, uid: bytes):
-        """Mark an email as read (Seen) so it's not processed again."""
+        """
+        Mark an email as read (Seen) so it's not processed again.
+        Inside a fetch_booking_emails() block this is queued and applied on
+        the open connection; otherwise a short-lived connection is used.
+        """
+        if self._mail is not None:
+            self._seen.append(uid)
+            return
+        self._mark_on_new_connection([uid])
+
+    def _mark_on_new_connection(self, uids: List[bytes]):
         try:
             mail = self._connect()
-            mail.store(uid, "+FLAGS", "\\Seen")
-            mail.logout()
-            logger.debug(f"✅ Marked email UID {uid} as read.")
         except Exception as e:
-            logger.error(f"❌ Could not mark email as read: {e}")
+            logger.error("❌ Could not mark email as read: %s", e)
+            return
+        try:
+            self._store_seen(mail, uids)
+        finally:
+            try:
+                mail.logout()
+            except Exception as e:
+                logger.warning("IMAP logout failed: %s", e)
+
+    @staticmethod
+    def _store_seen(mail: imaplib.IMAP4_SSL, uids: List[bytes]) -> bool:
+        try:
+            mail.store(b",".join(uids).decode(), "+FLAGS", "\\Seen")
+            logger.debug("✅ Marked email UID(s) %s as read.", b",".join(uids).decode())
+            return True
+        except Exception as e:
+            logger.error("❌ Could not mark email as read: %s", e)
+            return False
 
     @staticmethod
     def _decode_header_value(value: str) -> str:
@@ -155,7 +369,7 @@ class EmailReader:
     @staticmethod
     def _parse_sender(from_raw: str):
         """Extract name and email address from a From: header."""
-        match = re.match(r'"?([^"<]*)"?\s*<([^>]+)>', from_raw)
+        match = SENDER_RE.match(from_raw)
         if match:
             name = match.group(1).strip() or match.group(2).split("@")[0]
             email_addr = match.group(2).strip()
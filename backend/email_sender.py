@@ -3,108 +3,34 @@ email_sender.py - The Voice 🗣️
 Sends beautiful HTML confirmation and failure notification emails via SMTP.
 """
 
+import asyncio
+import copy
 import logging
-import smtplib
 from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from string import Template
 from typing import Dict, Optional
 
+import aiosmtplib
+
 logger = logging.getLogger("EmailSender")
 
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 587
 
+# Plain text fallback, built once and copied into every message
+_PLAIN_FALLBACK = MIMEText("Please view this email in an HTML-capable email client.", "plain")
 
-class EmailSender:
-    def __init__(self, gmail_address: str, app_password: str):
-        self.gmail_address = gmail_address
-        self.app_password = app_password
-
-    def send_confirmation_email(
-        self,
-        to_email: str,
-        guest_name: str,
-        booking_details: Dict,
-        booking_id: str,
-        confirmation_message: str = "",
-    ):
-        """Send a beautiful HTML confirmation email."""
-        subject = f"✅ Room Booking Confirmed - #{booking_id}"
-        html_body = self._build_confirmation_html(
-            guest_name=guest_name,
-            booking_details=booking_details,
-            booking_id=booking_id,
-        )
-        self._send(to_email, subject, html_body)
-        logger.info(f"✅ Confirmation email sent to {to_email}")
-
-    def send_failure_email(
-        self,
-        to_email: str,
-        guest_name: str,
-        reason: str,
-    ):
-        """Send a friendly failure notification email."""
-        subject = "⚠️ Room Booking - Action Required"
-        html_body = self._build_failure_html(
-            guest_name=guest_name,
-            reason=reason,
-        )
-        self._send(to_email, subject, html_body)
-        logger.info(f"📧 Failure notification sent to {to_email}")
-
-    def _send(self, to_email: str, subject: str, html_body: str):
-        """Core SMTP send logic."""
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = f"Hotel Booking System <{self.gmail_address}>"
-        msg["To"] = to_email
-
-        # Plain text fallback
-        plain_text = "Please view this email in an HTML-capable email client."
-        msg.attach(MIMEText(plain_text, "plain"))
-        msg.attach(MIMEText(html_body, "html"))
-
-        try:
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.ehlo()
-                server.starttls()
-                server.login(self.gmail_address, self.app_password)
-                server.sendmail(self.gmail_address, to_email, msg.as_string())
-                logger.debug(f"📤 Email sent to {to_email}: '{subject}'")
-        except smtplib.SMTPAuthenticationError:
-            logger.error("❌ SMTP authentication failed. Check Gmail App Password.")
-            raise
-        except Exception as e:
-            logger.error(f"❌ Failed to send email to {to_email}: {e}")
-            raise
-
-    # ── HTML Templates ───────────────────────────────────────────────────────
-    @staticmethod
-    def _build_confirmation_html(
-        guest_name: str,
-        booking_details: Dict,
-        booking_id: str,
-    ) -> str:
-        check_in = booking_details.get("check_in", "N/A")
-        check_out = booking_details.get("check_out", "N/A")
-        room_type = booking_details.get("room_type", "N/A")
-        num_adults = booking_details.get("num_adults", 1)
-        num_children = booking_details.get("num_children", 0)
-        now = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-
-        # Calculate nights
-        nights = "N/A"
-        try:
-            from datetime import date
-            ci = date.fromisoformat(check_in)
-            co = date.fromisoformat(check_out)
-            nights = str((co - ci).days)
-        except Exception:
-            pass
+# ── HTML Templates ───────────────────────────────────────────────────────────
+# Parsed once at import; each email only substitutes its own values
+_ROW_TPL = """
+              <tr style="background:%s;">
+                <td style="padding:12px 18px;font-size:13px;color:#888;width:40%%;border-top:1px solid #e8eaed;">%s</td>
+                <td style="padding:12px 18px;font-size:13px;color:#1a1a2e;font-weight:600;border-top:1px solid #e8eaed;">%s</td>
+              </tr>"""
 
-        return f"""<!DOCTYPE html>
+_CONFIRM_TPL = Template("""<!DOCTYPE html>
 <html lang="en">
 <head>
 <meta charset="UTF-8">
@@ -128,7 +54,7 @@ class EmailSender:
         <!-- Greeting -->
         <tr>
           <td style="padding:35px 40px 20px;">
-            <p style="color:#333;font-size:16px;margin:0 0 6px;">Dear <strong>{guest_name}</strong>,</p>
+            <p style="color:#333;font-size:16px;margin:0 0 6px;">Dear <strong>$guest_name</strong>,</p>
             <p style="color:#555;font-size:14px;margin:0;line-height:1.6;">
               We're delighted to confirm your room reservation. Your booking details are listed below.
               We look forward to welcoming you!
@@ -141,7 +67,7 @@ class EmailSender:
           <td style="padding:0 40px 20px;">
             <div style="background:#e8f0fe;border-left:4px solid #1a73e8;border-radius:6px;padding:14px 18px;">
               <span style="color:#1a73e8;font-size:13px;font-weight:600;text-transform:uppercase;letter-spacing:0.5px;">Booking Reference</span>
-              <div style="color:#1a1a2e;font-size:22px;font-weight:700;margin-top:4px;">#{booking_id}</div>
+              <div style="color:#1a1a2e;font-size:22px;font-weight:700;margin-top:4px;">#$booking_id</div>
             </div>
           </td>
         </tr>
@@ -155,13 +81,7 @@ class EmailSender:
                   Reservation Details
                 </td>
               </tr>
-              {EmailSender._detail_row("🛏️ Room Type", room_type)}
-              {EmailSender._detail_row("📅 Check-In", check_in, alt=True)}
-              {EmailSender._detail_row("📅 Check-Out", check_out)}
-              {EmailSender._detail_row("🌙 Nights", nights, alt=True)}
-              {EmailSender._detail_row("👤 Adults", str(num_adults))}
-              {EmailSender._detail_row("👶 Children", str(num_children), alt=True)}
-              {EmailSender._detail_row("👤 Guest Name", guest_name)}
+              $details_rows
             </table>
           </td>
         </tr>
@@ -184,7 +104,7 @@ class EmailSender:
         <tr>
           <td style="background:#f8f9fa;padding:25px 40px;text-align:center;border-top:1px solid #e8eaed;">
             <p style="margin:0;font-size:13px;color:#666;">
-              Confirmation generated on {now}<br>
+              Confirmation generated on $now<br>
               Questions? Reply to this email or contact our front desk.
             </p>
             <p style="margin:12px 0 0;font-size:12px;color:#999;">
@@ -196,21 +116,9 @@ class EmailSender:
     </td></tr>
   </table>
 </body>
-</html>"""
-
-    @staticmethod
-    def _detail_row(label: str, value: str, alt: bool = False) -> str:
-        bg = "#f8f9fa" if alt else "#ffffff"
-        return f"""
-              <tr style="background:{bg};">
-                <td style="padding:12px 18px;font-size:13px;color:#888;width:40%;border-top:1px solid #e8eaed;">{label}</td>
-                <td style="padding:12px 18px;font-size:13px;color:#1a1a2e;font-weight:600;border-top:1px solid #e8eaed;">{value}</td>
-              </tr>"""
+</html>""")
 
-    @staticmethod
-    def _build_failure_html(guest_name: str, reason: str) -> str:
-        now = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-        return f"""<!DOCTYPE html>
+_FAIL_TPL = Template("""<!DOCTYPE html>
 <html lang="en">
 <head>
 <meta charset="UTF-8">
@@ -234,7 +142,7 @@ class EmailSender:
         <!-- Body -->
         <tr>
           <td style="padding:35px 40px 20px;">
-            <p style="color:#333;font-size:16px;margin:0 0 6px;">Dear <strong>{guest_name}</strong>,</p>
+            <p style="color:#333;font-size:16px;margin:0 0 6px;">Dear <strong>$guest_name</strong>,</p>
             <p style="color:#555;font-size:14px;margin:0;line-height:1.6;">
               We were unable to complete your room booking request. Here's what happened:
             </p>
@@ -246,7 +154,7 @@ class EmailSender:
           <td style="padding:0 40px 25px;">
             <div style="background:#fdecea;border-left:4px solid #e53935;border-radius:6px;padding:16px 18px;">
               <p style="margin:0;font-size:13px;color:#b71c1c;font-weight:600;">Reason</p>
-              <p style="margin:6px 0 0;font-size:14px;color:#333;line-height:1.6;">{reason}</p>
+              <p style="margin:6px 0 0;font-size:14px;color:#333;line-height:1.6;">$reason</p>
             </div>
           </td>
         </tr>
@@ -281,7 +189,7 @@ class EmailSender:
         <tr>
           <td style="background:#f8f9fa;padding:25px 40px;text-align:center;border-top:1px solid #e8eaed;">
             <p style="margin:0;font-size:13px;color:#666;">
-              Processed on {now}<br>
+              Processed on $now<br>
               We apologize for the inconvenience.
             </p>
             <p style="margin:12px 0 0;font-size:12px;color:#999;">
@@ -293,4 +201,163 @@ class EmailSender:
     </td></tr>
   </table>
 </body>
-</html>"""
+</html>""")
+
+
+class EmailSender:
+    def __init__(self, gmail_address: str, app_password: str):
+        self.gmail_address = gmail_address
+        self.app_password = app_password
+        self._server = None
+        self._connect_lock = asyncio.Lock()
+
+    # ── Connection ───────────────────────────────────────────────────────────
+    async def open(self) -> aiosmtplib.SMTP:
+        """Connect and log in once; the session is reused until close()."""
+        async with self._connect_lock:
+            if self._server is None:
+                # start_tls=True: connect() does EHLO + STARTTLS on port 587
+                server = aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT, start_tls=True)
+                await server.connect()
+                try:
+                    await server.login(self.gmail_address, self.app_password)
+                except Exception:
+                    server.close()
+                    raise
+                self._server = server
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            try:
+                await self._server.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    async def _discard(self, stale: Optional[aiosmtplib.SMTP]):
+        """Forget a dropped session, unless a concurrent send already replaced it."""
+        async with self._connect_lock:
+            if stale is not None and self._server is stale:
+                self._server = None
+                stale.close()
+
+    async def __aenter__(self):
+        # Connects lazily on the first send
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def send_confirmation_email(
+        self,
+        to_email: str,
+        guest_name: str,
+        booking_details: Dict,
+        booking_id: str,
+        confirmation_message: str = "",
+        now: Optional[datetime] = None,
+    ):
+        """Send a beautiful HTML confirmation email."""
+        subject = f"✅ Room Booking Confirmed - #{booking_id}"
+        html_body = self._build_confirmation_html(
+            guest_name=guest_name,
+            booking_details=booking_details,
+            booking_id=booking_id,
+            now=now,
+        )
+        await self._send(to_email, subject, html_body)
+        logger.info(f"✅ Confirmation email sent to {to_email}")
+
+    async def send_failure_email(
+        self,
+        to_email: str,
+        guest_name: str,
+        reason: str,
+        now: Optional[datetime] = None,
+    ):
+        """Send a friendly failure notification email."""
+        subject = "⚠️ Room Booking - Action Required"
+        html_body = self._build_failure_html(
+            guest_name=guest_name,
+            reason=reason,
+            now=now,
+        )
+        await self._send(to_email, subject, html_body)
+        logger.info(f"📧 Failure notification sent to {to_email}")
+
+    async def _send(self, to_email: str, subject: str, html_body: str):
+        """Core SMTP send logic."""
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = f"Hotel Booking System <{self.gmail_address}>"
+        msg["To"] = to_email
+
+        msg.attach(copy.copy(_PLAIN_FALLBACK))
+        msg.attach(MIMEText(html_body, "html"))
+
+        server = None
+        try:
+            try:
+                server = await self.open()
+                await server.send_message(msg, sender=self.gmail_address, recipients=[to_email])
+            except aiosmtplib.SMTPServerDisconnected:
+                # Server dropped the idle session; reconnect once
+                await self._discard(server)
+                server = await self.open()
+                await server.send_message(msg, sender=self.gmail_address, recipients=[to_email])
+            logger.debug(f"📤 Email sent to {to_email}: '{subject}'")
+        except aiosmtplib.SMTPAuthenticationError:
+            logger.error("❌ SMTP authentication failed. Check Gmail App Password.")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Failed to send email to {to_email}: {e}")
+            raise
+
+    # ── HTML Templates ───────────────────────────────────────────────────────
+    @staticmethod
+    def _build_confirmation_html(
+        guest_name: str,
+        booking_details: Dict,
+        booking_id: str,
+        now: Optional[datetime] = None,
+    ) -> str:
+        check_in = booking_details.get("check_in", "N/A")
+        check_out = booking_details.get("check_out", "N/A")
+        room_type = booking_details.get("room_type", "N/A")
+        num_adults = booking_details.get("num_adults", 1)
+        num_children = booking_details.get("num_children", 0)
+        now = (now or datetime.now()).strftime("%B %d, %Y at %I:%M %p")
+
+        # Calculate nights
+        nights = "N/A"
+        try:
+            from datetime import date
+            ci = date.fromisoformat(check_in)
+            co = date.fromisoformat(check_out)
+            nights = str((co - ci).days)
+        except Exception:
+            pass
+
+        rows = [
+            ("🛏️ Room Type", room_type, False),
+            ("📅 Check-In", check_in, True),
+            ("📅 Check-Out", check_out, False),
+            ("🌙 Nights", nights, True),
+            ("👤 Adults", num_adults, False),
+            ("👶 Children", num_children, True),
+            ("👤 Guest Name", guest_name, False),
+        ]
+        details_rows = "".join(
+            _ROW_TPL % ("#f8f9fa" if alt else "#ffffff", label, value)
+            for label, value, alt in rows
+        )
+        return _CONFIRM_TPL.substitute(
+            guest_name=guest_name, booking_id=booking_id,
+            details_rows=details_rows, now=now,
+        )
+
+    @staticmethod
+    def _build_failure_html(guest_name: str, reason: str, now: Optional[datetime] = None) -> str:
+        now = (now or datetime.now()).strftime("%B %d, %Y at %I:%M %p")
+        return _FAIL_TPL.substitute(guest_name=guest_name, reason=reason, now=now)
@@ -3,21 +3,24 @@ main.py - The Brain
 Orchestrates the entire room-booking agent loop.
 """
 
+import asyncio
 import sys
 import logging
+import logging.handlers
 import os
+from contextlib import AsyncExitStack
 from datetime import datetime
+from functools import partial
 
 # Fix emoji encoding on Windows
 sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr.reconfigure(encoding='utf-8')
 
-from apscheduler.schedulers.blocking import BlockingScheduler
 from dotenv import load_dotenv
 
 from backend.email_reader import EmailReader
 from backend.rasa_service import BookingParser
-from backend.booking_service import BookingService
+from backend.booking_service import BookingPool, BookingService
 from backend.email_sender import EmailSender
 
 load_dotenv()
@@ -31,86 +34,47 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S",
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler(f"logs/agent_{datetime.now().strftime('%Y%m%d')}.log", encoding='utf-8'),
+        # Rolls over at midnight, so a long-running agent still gets one file per day
+        logging.handlers.TimedRotatingFileHandler("logs/agent.log", when="midnight", backupCount=14, encoding='utf-8'),
     ],
 )
 logger = logging.getLogger("RoomBookingAgent")
 
 
-def process_booking_emails():
-    logger.info("-" * 60)
-    logger.info("Checking Gmail for new booking requests ...")
+async def process_one(email_data, details, booking_pool, email_sender, now) -> bytes:
+    """Book and reply to one parsed email. Returns its uid once it is done."""
+    sender_email = email_data["from"]
+    sender_name  = email_data["sender_name"]
+    uid          = email_data["uid"]
 
-    email_reader = EmailReader(
-        gmail_address=os.getenv("GMAIL_ADDRESS"),
-        app_password=os.getenv("GMAIL_APP_PASSWORD"),
-    )
-    booking_parser = BookingParser(
-        anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
-    )
-    booking_service = BookingService(
-        website_url=os.getenv("BOOKING_URL", "https://booking.heykoala.ai"),
-        admin_username=os.getenv("ADMIN_USERNAME"),
-        admin_password=os.getenv("ADMIN_PASSWORD"),
-        headless=os.getenv("HEADLESS", "true").lower() == "true",
-    )
-    email_sender = EmailSender(
-        gmail_address=os.getenv("GMAIL_ADDRESS"),
-        app_password=os.getenv("GMAIL_APP_PASSWORD"),
-    )
+    logger.info(f"From: {sender_email}  |  {email_data['subject']}")
 
     try:
-        emails = email_reader.fetch_booking_emails()
-    except Exception as e:
-        logger.error(f"Failed to fetch emails: {e}")
-        return
-
-    if not emails:
-        logger.info("No new booking emails.")
-        return
-
-    logger.info(f"{len(emails)} new request(s) found.")
-
-    for email_data in emails:
-        sender_email = email_data["from"]
-        sender_name  = email_data["sender_name"]
-        body         = email_data["body"]
-        uid          = email_data["uid"]
-
-        logger.info(f"From: {sender_email}  |  {email_data['subject']}")
-
-        # 1. Parse
-        try:
-            details = booking_parser.extract_booking_info(
-                email_body=body,
-                sender_name=sender_name,
-                sender_email=sender_email,
-            )
-            details["guest_email"] = sender_email
-            logger.info(f"Parsed: {details}")
-        except Exception as e:
-            logger.error(f"Parse failed: {e}")
-            email_sender.send_failure_email(
+        # 1. Parsed up front for the whole batch; None means parsing failed
+        if details is None:
+            await email_sender.send_failure_email(
                 to_email=sender_email, guest_name=sender_name,
                 reason="We could not understand your booking request. Please include check-in date, check-out date, room type, and number of guests.",
+                now=now,
             )
-            email_reader.mark_as_read(uid)
-            continue
+            return uid
+        details["guest_email"] = sender_email
+        logger.info(f"Parsed: {details}")
 
         # 2. Validate minimum fields
         missing = [f for f, k in [("check-in date","check_in"),("check-out date","check_out"),("room type","room_type")] if not details.get(k)]
         if missing:
-            email_sender.send_failure_email(
+            await email_sender.send_failure_email(
                 to_email=sender_email,
                 guest_name=details.get("guest_name", sender_name),
                 reason=f"Your request was missing: {', '.join(missing)}. Please reply with all details.",
+                now=now,
             )
-            email_reader.mark_as_read(uid)
-            continue
+            return uid
 
         # 3. Book
         try:
-            result = booking_service.create_booking(details)
+            result = await booking_pool.create_booking(details)
         except Exception as e:
             logger.error(f"Booking crashed: {e}", exc_info=True)
             result = {"success": False, "message": str(e), "booking_id": None}
@@ -119,21 +83,100 @@ def process_booking_emails():
         guest_name = details.get("guest_name", sender_name)
         if result["success"]:
             logger.info(f"Booking confirmed - ID: {result.get('booking_id')}")
-            email_sender.send_confirmation_email(
+            await email_sender.send_confirmation_email(
                 to_email=sender_email, guest_name=guest_name,
                 booking_details=details, booking_id=result.get("booking_id","N/A"),
                 confirmation_message=result.get("message",""),
+                now=now,
             )
         else:
             logger.warning(f"Booking failed: {result['message']}")
-            email_sender.send_failure_email(
+            await email_sender.send_failure_email(
                 to_email=sender_email, guest_name=guest_name,
                 reason=result["message"],
+                now=now,
             )
+    except Exception as e:
+        # Still marked read, so a confirmed booking is never retried (and booked twice)
+        logger.error(f"Reply to {sender_email} failed: {e}")
+    return uid
+
+
+async def process_booking_emails(email_reader, booking_parser, booking_pool, email_sender):
+    logger.info("-" * 60)
+    logger.info("Checking Gmail for new booking requests ...")
+
+    # Keep the IMAP connection open for the batch; mark_as_read calls are
+    # applied on it in one STORE when the block exits
+    async with AsyncExitStack() as stack:
+        try:
+            emails = stack.enter_context(email_reader.fetch_booking_emails())
+        except Exception as e:
+            logger.error(f"Failed to fetch emails: {e}")
+            return
+
+        if not emails:
+            logger.info("No new booking emails.")
+            return
+
+        logger.info(f"{len(emails)} new request(s) found.")
+
+        # One clock reading for the batch, shared by parsing and the replies
+        now = datetime.now()
+
+        # Parse the whole batch in one (blocking) Claude request on a worker thread
+        try:
+            parsed = await asyncio.to_thread(booking_parser.extract_many, emails, now)
+        except Exception as e:
+            logger.error(f"Parse failed: {e}")
+            parsed = [None] * len(emails)
+
+        # One SMTP session for the batch (the browser outlives it);
+        # every email runs through process_one concurrently
+        await stack.enter_async_context(email_sender)
+
+        uids = await asyncio.gather(*(
+            process_one(email_data, details, booking_pool, email_sender, now)
+            for email_data, details in zip(emails, parsed)
+        ))
+        # Queued here, written in one STORE when the fetch block exits
+        for uid in uids:
+            email_reader.mark_as_read(uid)
+
+        logger.info("All emails processed.")
+
+
+async def poll_safely(poll):
+    """Run one poll; a failure is logged so the agent keeps waiting for mail."""
+    try:
+        await poll()
+    except Exception as e:
+        logger.error(f"Processing emails failed: {e}", exc_info=True)
 
-        email_reader.mark_as_read(uid)
 
-    logger.info("All emails processed.")
+async def run_agent(poll, email_reader, booking_pool, retry_interval: int):
+    idle_check = None
+    try:
+        logger.info("Waiting for new mail (IMAP IDLE). Ctrl+C to stop.")
+        while True:
+            # Short IDLE checks on a worker thread keep Ctrl+C responsive. The first
+            # call opens the connection and enters IDLE before returning True, so
+            # the catch-up poll below can't miss mail that lands while it runs.
+            idle_check = asyncio.ensure_future(asyncio.to_thread(email_reader.wait_for_new_mail))
+            try:
+                new_mail = await asyncio.shield(idle_check)
+            except Exception as e:
+                logger.error(f"IMAP IDLE failed: {e}. Retrying in {retry_interval}s.")
+                await asyncio.sleep(retry_interval)
+                continue
+            if new_mail:
+                await poll_safely(poll)
+    finally:
+        # Let an in-flight IDLE check finish before closing its socket
+        if idle_check is not None and not idle_check.done():
+            await asyncio.wait({idle_check})
+        email_reader.close()
+        await booking_pool.stop()
 
 
 def main():
@@ -143,17 +186,35 @@ def main():
     logger.info(f"  Gmail    : {os.getenv('GMAIL_ADDRESS')}")
     logger.info(f"  Hotel    : {os.getenv('BOOKING_URL')}")
     logger.info(f"  Username : {os.getenv('ADMIN_USERNAME')}")
-    logger.info(f"  Interval : {interval}s")
+    logger.info(f"  Retry    : {interval}s")
     logger.info(f"  Headless : {os.getenv('HEADLESS','true')}")
     logger.info("=" * 60)
 
-    process_booking_emails()
+    # Built once and reused by every poll
+    email_reader = EmailReader(
+        gmail_address=os.getenv("GMAIL_ADDRESS"),
+        app_password=os.getenv("GMAIL_APP_PASSWORD"),
+    )
+    booking_parser = BookingParser(
+        anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+    )
+    booking_pool = BookingPool(
+        BookingService(
+            website_url=os.getenv("BOOKING_URL", "https://booking.heykoala.ai"),
+            admin_username=os.getenv("ADMIN_USERNAME"),
+            admin_password=os.getenv("ADMIN_PASSWORD"),
+            headless=os.getenv("HEADLESS", "true").lower() == "true",
+        ),
+        max_concurrent=int(os.getenv("MAX_CONCURRENT_BOOKINGS", 4)),
+    )
+    email_sender = EmailSender(
+        gmail_address=os.getenv("GMAIL_ADDRESS"),
+        app_password=os.getenv("GMAIL_APP_PASSWORD"),
+    )
+    poll = partial(process_booking_emails, email_reader, booking_parser, booking_pool, email_sender)
 
-    scheduler = BlockingScheduler()
-    scheduler.add_job(process_booking_emails, "interval", seconds=interval, id="email_check")
     try:
-        logger.info(f"Scheduler running. Checking every {interval}s. Ctrl+C to stop.")
-        scheduler.start()
+        asyncio.run(run_agent(poll, email_reader, booking_pool, interval))
     except (KeyboardInterrupt, SystemExit):
         logger.info("Agent stopped. Goodbye!")
 
@@ -9,11 +9,25 @@ Year logic:
   - If that date has already passed, we assume NEXT year.
 """
 
-import json
+import hashlib
 import logging
+import os
 import re
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+try:
+    import ahocorasick
+except ImportError:  # optional: regex fallback below
+    ahocorasick = None
+
+try:
+    from orjson import loads as _loads
+except ImportError:  # optional: same result, slower parse
+    from json import loads as _loads
 
 logger = logging.getLogger("BookingParser")
 
@@ -49,6 +63,114 @@ ROOM_TYPE_MAP = {
     "beach": "Deluxe Sea View Room",
 }
 
+WORD_NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+
+# ── Precompiled patterns ─────────────────────────────────────────────────────
+NAME_PATTERNS = [
+    re.compile(p, re.IGNORECASE | re.MULTILINE)
+    for p in (
+        r"my name is ([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
+        r"(?:booking for|guest(?:\s*name)?[:\s]+)([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
+        r"^(?:Hi|Hello|Dear)[,\s]+(?:I am|I'm)\s+([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
+    )
+]
+ISO_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+TOMORROW_RE = re.compile(r"\btomorrow\b", re.IGNORECASE)
+CODEFENCE_RE = re.compile(r"```json|```")
+QUOTED_LINE_RE = re.compile(r"^(?:>.*|On .*wrote:[ \t]*)$\n?", re.MULTILINE)
+SIGNATURE_RE = re.compile(r"^-- ?$", re.MULTILINE)
+
+# Natural language dates: "22nd March", "March 22", "22 March 2026"
+# Longest first, so "january" is never taken as "jan" + "uary"
+MONTH_ALT = "|".join(sorted(MONTH_MAP, key=len, reverse=True))
+NUMERIC_DATE_RE = re.compile(r"\b\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b")   # 22/03/2026, 3/22, 22.03
+MONTH_WORD_RE = re.compile(rf"\b(?:{MONTH_ALT})\b", re.IGNORECASE)
+DATE_RES = [
+    re.compile(rf"\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?P<month>{MONTH_ALT})\s*(?:,?\s*(?P<year>\d{{4}}))?", re.IGNORECASE),   # 22nd March 2026
+    re.compile(rf"(?P<month>{MONTH_ALT})\s+\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?[,\s]*(?:,?\s*(?P<year>\d{{4}}))?", re.IGNORECASE), # March 22, 2026
+]
+
+# Room keywords: one scan of the text, longest keyword wins and ties go to the
+# one listed first in ROOM_TYPE_MAP
+ROOM_KEY_RANK = {k: (len(k), -i) for i, k in enumerate(ROOM_TYPE_MAP)}
+ROOM_TYPE_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(ROOM_TYPE_MAP, key=len, reverse=True))
+)
+if ahocorasick is not None:
+    _AC = ahocorasick.Automaton()
+    for _keyword, _room in ROOM_TYPE_MAP.items():
+        _AC.add_word(_keyword, (ROOM_KEY_RANK[_keyword], _room))
+    _AC.make_automaton()
+else:
+    _AC = None
+
+BOOKING_JSON_SCHEMA = """{
+  "guest_name": "string or null",
+  "check_in": "YYYY-MM-DD or null",
+  "check_out": "YYYY-MM-DD or null",
+  "room_type": "one of: Standard, Deluxe, Suite, Premium Suite, Family, Executive Suite, Presidential Suite, Penthouse, Deluxe Sea View Room, or null",
+  "num_adults": integer,
+  "num_children": integer
+}"""
+
+
+def _looks_like_booking(text: str) -> bool:
+    """Cheap check for a date and a room keyword before paying for a Claude call."""
+    if not (
+        ISO_DATE_RE.search(text) or NUMERIC_DATE_RE.search(text)
+        or MONTH_WORD_RE.search(text) or TOMORROW_RE.search(text)
+    ):
+        return False
+    lowered = text.lower()
+    if _AC is not None:
+        return next(_AC.iter(lowered), None) is not None
+    return ROOM_TYPE_RE.search(lowered) is not None
+
+
+def _trim_email(body: str) -> str:
+    """Drop quoted thread history and the signature, and cap the length sent to Claude."""
+    sig = SIGNATURE_RE.search(body)
+    if sig:
+        body = body[:sig.start()]
+    body = QUOTED_LINE_RE.sub("", body).strip()
+    return body[:int(os.getenv("MAX_EMAIL_CHARS", 4000))]
+
+
+CLAUDE_CACHE_SIZE = 512
+CLAUDE_BATCH_SIZE = 10  # emails per batched request; bounds max_tokens
+
+# One client (and one keep-alive connection pool) per API key, shared by every parser
+_ANTHROPIC_CLIENTS: Dict[str, object] = {}
+
+
+def _get_anthropic_client(api_key: str):
+    client = _ANTHROPIC_CLIENTS.get(api_key)
+    if client is None:
+        import anthropic
+        import httpx
+
+        client = anthropic.Anthropic(
+            api_key=api_key,
+            # SDK defaults (timeouts, redirects) plus a longer-lived keep-alive pool
+            http_client=anthropic.DefaultHttpxClient(
+                limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+            ),
+        )
+        _ANTHROPIC_CLIENTS[api_key] = client
+    return client
+
+
+@lru_cache(maxsize=None)
+def _number_patterns(keyword_pattern: str):
+    """'2 adults' / 'adults: 2' patterns for a keyword, compiled once."""
+    return (
+        re.compile(rf"(\d+|{'|'.join(WORD_NUMBERS)})\s+(?:{keyword_pattern})", re.IGNORECASE),
+        re.compile(rf"(?:{keyword_pattern})[:\s]+(\d+)", re.IGNORECASE),
+    )
+
 
 class BookingParser:
     def __init__(self, anthropic_api_key: Optional[str] = None):
@@ -57,30 +179,96 @@ class BookingParser:
 
         if anthropic_api_key:
             try:
-                import anthropic
-                self._client = anthropic.Anthropic(api_key=anthropic_api_key)
+                self._client = _get_anthropic_client(anthropic_api_key)
+                # Per-instance LRU of parsed replies so resent emails don't re-hit the API
+                self._claude_cache = OrderedDict()
+                self._claude_cache_lock = threading.Lock()
                 logger.info("Claude AI parser initialized.")
             except ImportError:
                 logger.warning("anthropic package not found. Using regex-only parsing.")
 
-    def extract_booking_info(self, email_body: str, sender_name: str = "", sender_email: str = "") -> Dict:
+    def extract_booking_info(
+        self, email_body: str, sender_name: str = "", sender_email: str = "", now: Optional[datetime] = None,
+    ) -> Dict:
         """
         Extract booking details from email body.
         Tries Claude AI first, falls back to regex.
         """
+        now = now or datetime.now()
         result = None
 
-        if self._client:
+        if self._client and not _looks_like_booking(email_body):
+            logger.info("No date or room type mentioned; skipping Claude.")
+        elif self._client:
             try:
-                result = self._parse_with_claude(email_body, sender_name)
+                result = self._parse_with_claude(email_body, sender_name, now=now)
                 logger.info("Used Claude AI for parsing.")
             except Exception as e:
                 logger.warning(f"Claude parsing failed ({e}), falling back to regex.")
 
         if not result:
-            result = self._parse_with_regex(email_body)
+            result = self._parse_with_regex(email_body, now=now)
             logger.info("Used regex for parsing.")
 
+        return self._finalize(result, sender_name, sender_email, now=now)
+
+    def extract_many(self, emails: List[Dict], now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Extract booking details for a batch of fetched emails, in order.
+        Sends one Claude request per CLAUDE_BATCH_SIZE emails; any email
+        Claude gets wrong (or leaves out) falls back to regex on its own.
+        """
+        now = now or datetime.now()
+
+        # Only emails that pass the cheap prefilter are worth sending to Claude
+        wanted = [i for i, em in enumerate(emails) if _looks_like_booking(em["body"])] if self._client else []
+        if len(wanted) < 2:
+            return [
+                self.extract_booking_info(em["body"], em["sender_name"], em["from"], now=now)
+                for em in emails
+            ]
+
+        # Resent bodies are answered from the cache; only the rest go to Claude
+        claude_results, one_by_one, keys, to_send = {}, set(), {}, []
+        for i in wanted:
+            keys[i] = self._cache_key(emails[i]["body"], emails[i]["sender_name"], now)
+            cached = self._cache_get(keys[i])
+            if cached is not None:
+                claude_results[i] = cached
+            else:
+                to_send.append(i)
+        if len(to_send) < len(wanted):
+            logger.info(f"{len(wanted) - len(to_send)} email(s) answered from the Claude cache.")
+
+        for start in range(0, len(to_send), CLAUDE_BATCH_SIZE):
+            chunk = to_send[start:start + CLAUDE_BATCH_SIZE]
+            try:
+                parsed = self._parse_many_with_claude([emails[i]["body"] for i in chunk], now=now)
+                logger.info(f"Used Claude AI for parsing {len(chunk)} emails in one request.")
+            except Exception as e:
+                logger.warning(f"Batched Claude parsing failed ({e}), parsing {len(chunk)} emails one by one.")
+                one_by_one.update(chunk)
+                continue
+            for n, result in parsed.items():
+                self._cache_put(keys[chunk[n]], result)
+                claude_results[chunk[n]] = dict(result)
+
+        results = []
+        for i, email_data in enumerate(emails):
+            if i in one_by_one:
+                results.append(self.extract_booking_info(
+                    email_data["body"], email_data["sender_name"], email_data["from"], now=now,
+                ))
+                continue
+            result = claude_results.get(i)
+            if not result:
+                if i in wanted:
+                    logger.warning(f"No usable Claude result for email {i + 1}, falling back to regex.")
+                result = self._parse_with_regex(email_data["body"], now=now)
+            results.append(self._finalize(result, email_data["sender_name"], email_data["from"], now=now))
+        return results
+
+    def _finalize(self, result: Dict, sender_name: str, sender_email: str, now: datetime) -> Dict:
         # Apply defaults
         if not result.get("guest_name"):
             result["guest_name"] = sender_name or sender_email.split("@")[0]
@@ -91,15 +279,51 @@ class BookingParser:
         # Ensure year is set on dates (never leave year as None or current year if past)
         for key in ("check_in", "check_out"):
             if result.get(key):
-                result[key] = self._ensure_year(result[key])
+                result[key] = self._ensure_year(result[key], today=now.date())
 
         logger.info(f"Final parsed details: {result}")
         return result
 
     # ── Claude AI Parsing ────────────────────────────────────────────────────
-    def _parse_with_claude(self, email_body: str, sender_name: str) -> Dict:
-        today = datetime.now().strftime("%Y-%m-%d")
-        current_year = datetime.now().year
+    def _parse_with_claude(self, email_body: str, sender_name: str, now: datetime) -> Dict:
+        key = self._cache_key(email_body, sender_name, now)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        parsed = self._claude_request(_trim_email(email_body), sender_name, key[2])
+        for date_key in ("check_in", "check_out"):
+            if parsed.get(date_key):
+                parsed[date_key] = self._normalize_date(parsed[date_key])
+
+        self._cache_put(key, parsed)
+        return dict(parsed)
+
+    # ── Claude result cache ──────────────────────────────────────────────────
+    @staticmethod
+    def _cache_key(email_body: str, sender_name: str, now: datetime) -> tuple:
+        # Keyed by date (not time) so "tomorrow" stays correct across days
+        body_hash = hashlib.blake2b(email_body.encode(), digest_size=16).hexdigest()
+        return body_hash, sender_name, now.strftime("%Y-%m-%d")
+
+    def _cache_get(self, key: tuple) -> Optional[Dict]:
+        with self._claude_cache_lock:
+            cached = self._claude_cache.get(key)
+            if cached is None:
+                return None
+            self._claude_cache.move_to_end(key)
+        # Callers fill in defaults on the result; keep the cached copy pristine
+        return dict(cached)
+
+    def _cache_put(self, key: tuple, parsed: Dict):
+        with self._claude_cache_lock:
+            self._claude_cache[key] = parsed
+            if len(self._claude_cache) > CLAUDE_CACHE_SIZE:
+                self._claude_cache.popitem(last=False)
+
+    def _claude_request(self, email_body: str, sender_name: str, today: str) -> Dict:
+        """Ask Claude for the booking JSON and return it parsed."""
+        current_year = int(today[:4])
 
         prompt = f"""Extract hotel booking details from this email.
 Today's date is {today}. Current year is {current_year}.
@@ -108,14 +332,7 @@ EMAIL:
 {email_body}
 
 Return ONLY valid JSON with these exact keys (null for missing):
-{{
-  "guest_name": "string or null",
-  "check_in": "YYYY-MM-DD or null",
-  "check_out": "YYYY-MM-DD or null",
-  "room_type": "one of: Standard, Deluxe, Suite, Premium Suite, Family, Executive Suite, Presidential Suite, Penthouse, Deluxe Sea View Room, or null",
-  "num_adults": integer,
-  "num_children": integer
-}}
+{BOOKING_JSON_SCHEMA}
 
 IMPORTANT RULES:
 - If user writes "22 March" or "March 22" with NO year, assume year {current_year}
@@ -132,81 +349,103 @@ IMPORTANT RULES:
         )
 
         raw = response.content[0].text.strip()
-        raw = re.sub(r"```json|```", "", raw).strip()
-        parsed = json.loads(raw)
+        return _loads(CODEFENCE_RE.sub("", raw).strip())
 
-        for date_key in ("check_in", "check_out"):
-            if parsed.get(date_key):
-                parsed[date_key] = self._normalize_date(parsed[date_key])
+    def _parse_many_with_claude(self, bodies: List[str], now: datetime) -> Dict[int, Dict]:
+        """Results keyed by position in bodies; missing or ambiguous emails are left out."""
+        today = now.strftime("%Y-%m-%d")
+        current_year = now.year
+        emails = "\n\n".join(f"EMAIL {i}:\n{_trim_email(body)}" for i, body in enumerate(bodies, 1))
+
+        prompt = f"""Extract hotel booking details from each of these {len(bodies)} emails.
+Today's date is {today}. Current year is {current_year}.
+
+{emails}
+
+Return ONLY a valid JSON array with one object per email.
+Each object has an "email" key with the number of the EMAIL it describes (1 to {len(bodies)}),
+plus these exact keys (null for missing):
+{BOOKING_JSON_SCHEMA}
+
+IMPORTANT RULES:
+- If user writes "22 March" or "March 22" with NO year, assume year {current_year}
+- If that date is already past, assume year {current_year + 1}
+- Resolve "tomorrow" relative to today ({today})
+- Default num_adults=1, num_children=0 if not mentioned
+- If no guest name found, use null
+- Return ONLY the JSON array, no other text"""
 
-        return parsed
+        response = self._client.messages.create(
+            model="claude-sonnet-4-6",
+            max_tokens=400 * len(bodies),  # at most CLAUDE_BATCH_SIZE bodies per call
+            messages=[{"role": "user", "content": prompt}],
+        )
+
+        raw = response.content[0].text.strip()
+        parsed = _loads(CODEFENCE_RE.sub("", raw).strip())
+        if not isinstance(parsed, list):
+            raise ValueError("expected a JSON array")
+
+        # Match results to emails by their "email" number, never by position
+        by_index, seen = {}, set()
+        for item in parsed:
+            if not isinstance(item, dict):
+                continue
+            n = item.pop("email", None)
+            if not isinstance(n, int) or not 1 <= n <= len(bodies):
+                continue
+            if n in seen:
+                by_index.pop(n - 1, None)  # claimed twice: trust neither
+                continue
+            seen.add(n)
+            for date_key in ("check_in", "check_out"):
+                if item.get(date_key):
+                    item[date_key] = self._normalize_date(item[date_key])
+            by_index[n - 1] = item
+        return by_index
 
     # ── Regex Parsing ────────────────────────────────────────────────────────
-    def _parse_with_regex(self, text: str) -> Dict:
+    def _parse_with_regex(self, text: str, now: datetime) -> Dict:
         return {
             "guest_name": self._extract_name(text),
-            "check_in":   self._extract_date(text, is_checkin=True),
-            "check_out":  self._extract_date(text, is_checkin=False),
+            "check_in":   self._extract_date(text, is_checkin=True, today=now),
+            "check_out":  self._extract_date(text, is_checkin=False, today=now),
             "room_type":  self._extract_room_type(text.lower()),
-            "num_adults": self._extract_number(text.lower(), r"adult"),
-            "num_children": self._extract_number(text.lower(), r"child(?:ren)?|kid"),
+            # Number patterns are case-insensitive, no lowered copy needed
+            "num_adults": self._extract_number(text, r"adult"),
+            "num_children": self._extract_number(text, r"child(?:ren)?|kid"),
         }
 
     def _extract_name(self, text: str) -> Optional[str]:
-        patterns = [
-            r"my name is ([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
-            r"(?:booking for|guest(?:\s*name)?[:\s]+)([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
-            r"^(?:Hi|Hello|Dear)[,\s]+(?:I am|I'm)\s+([A-Z][a-z]+(?: [A-Z][a-z]+)*)",
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+        for pattern in NAME_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
         return None
 
-    def _extract_date(self, text: str, is_checkin: bool) -> Optional[str]:
-        today = datetime.now()
+    def _extract_date(self, text: str, is_checkin: bool, today: datetime) -> Optional[str]:
         current_year = today.year
 
         # "tomorrow"
-        if is_checkin and re.search(r"\btomorrow\b", text, re.IGNORECASE):
+        if is_checkin and TOMORROW_RE.search(text):
             return (today + timedelta(days=1)).strftime("%Y-%m-%d")
 
         # ISO: 2026-03-22
-        iso_matches = re.findall(r"\b(\d{4}-\d{2}-\d{2})\b", text)
+        iso_matches = ISO_DATE_RE.findall(text)
         if len(iso_matches) >= 2:
             return iso_matches[0] if is_checkin else iso_matches[1]
         elif len(iso_matches) == 1 and is_checkin:
             return iso_matches[0]
 
-        # Natural language dates: "22nd March", "March 22", "22 March 2026"
-        ordinal  = r"\b(\d{1,2})(?:st|nd|rd|th)?"
-        month_pat = "(" + "|".join(MONTH_MAP.keys()) + ")"
-        year_pat  = r"(?:,?\s*(\d{4}))?"
-
-        date_patterns = [
-            rf"{ordinal}\s+{month_pat}\s*{year_pat}",   # 22nd March 2026
-            rf"{month_pat}\s+{ordinal}[,\s]*{year_pat}", # March 22, 2026
-        ]
-
         all_dates = []
-        for pat in date_patterns:
-            for m in re.finditer(pat, text, re.IGNORECASE):
-                groups = [g for g in m.groups() if g]
-                day = month = year = None
-                for g in groups:
-                    g_lower = g.lower()
-                    if g_lower in MONTH_MAP:
-                        month = MONTH_MAP[g_lower]
-                    elif g.isdigit() and len(g) == 4:
-                        year = int(g)
-                    elif g.isdigit():
-                        day = int(g)
-
-                if day and month:
-                    # If no year given → assume current year
-                    if not year:
-                        year = current_year
+        for pat in DATE_RES:
+            for m in pat.finditer(text):
+                day = int(m["day"])
+                month = MONTH_MAP[m["month"].lower()]
+                # If no year given → assume current year
+                year = int(m["year"]) if m["year"] else current_year
+
+                if day:
                     try:
                         dt = datetime(year, month, day)
                         # If date already passed this year, push to next year
@@ -226,39 +465,34 @@ IMPORTANT RULES:
         return None
 
     def _extract_room_type(self, text: str) -> Optional[str]:
-        # Check multi-word matches first (longer = more specific)
-        for keyword in sorted(ROOM_TYPE_MAP.keys(), key=len, reverse=True):
-            if keyword in text:
-                return ROOM_TYPE_MAP[keyword]
-        return None
+        # Longest keyword found anywhere wins (longer = more specific)
+        if _AC is not None:
+            best = max((value for _, value in _AC.iter(text)), default=None)
+            return best[1] if best else None
+        best = max((m.group(0) for m in ROOM_TYPE_RE.finditer(text)), key=ROOM_KEY_RANK.get, default=None)
+        return ROOM_TYPE_MAP[best] if best else None
 
     def _extract_number(self, text: str, keyword_pattern: str) -> int:
-        word_numbers = {
-            "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
-            "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
-        }
-        pattern = rf"(\d+|{'|'.join(word_numbers.keys())})\s+(?:{keyword_pattern})"
-        match = re.search(pattern, text, re.IGNORECASE)
+        before, after = _number_patterns(keyword_pattern)
+        match = before.search(text)
         if match:
             val = match.group(1).lower()
-            return word_numbers.get(val, int(val) if val.isdigit() else 1)
+            return WORD_NUMBERS.get(val, int(val) if val.isdigit() else 1)
 
-        pattern2 = rf"(?:{keyword_pattern})[:\s]+(\d+)"
-        match2 = re.search(pattern2, text, re.IGNORECASE)
+        match2 = after.search(text)
         if match2:
             return int(match2.group(1))
         return 0
 
     @staticmethod
-    def _ensure_year(date_str: str) -> str:
+    def _ensure_year(date_str: str, today: date) -> str:
         """Make sure a YYYY-MM-DD date has a proper year (not 0001 or past)."""
         try:
             dt = datetime.strptime(date_str, "%Y-%m-%d")
-            today = datetime.now()
             # If year looks wrong (e.g. 0001), replace with current year
             if dt.year < 2020:
                 dt = dt.replace(year=today.year)
-                if dt.date() < today.date():
+                if dt.date() < today:
                     dt = dt.replace(year=today.year + 1)
             return dt.strftime("%Y-%m-%d")
         except Exception: